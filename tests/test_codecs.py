@@ -8,9 +8,11 @@
 import datetime
 import decimal
 import ipaddress
+import json
 import math
 import os
 import random
+import re
 import struct
 import unittest
 import uuid
@@ -41,6 +43,61 @@ current_timezone = _system_timezone()
 current_date = datetime.date.today()
 current_datetime = datetime.datetime.now()
 
+all_bytes_asc = bytes(range(256))
+all_bytes_desc = all_bytes_asc[::-1]
+large_bytea = b'f' * 1024 * 1024
+
+point_0_0 = asyncpg.Point(0.0, 0.0)
+point_1_1 = asyncpg.Point(1.0, 1.0)
+
+int32_struct = struct.Struct('!l')
+
+
+numeric_samples = (
+    -(2 ** 64),
+    2 ** 64,
+    -(2 ** 128),
+    2 ** 128,
+    -1, 0, 1,
+    decimal.Decimal(1234),
+    decimal.Decimal(-1234),
+    decimal.Decimal(str(1234.00088883231)),
+) + tuple(map(decimal.Decimal, (
+    "0.00000000000000",
+    "1.00000000000000",
+    "-1.00000000000000",
+    "-2.00000000000000",
+    "1000000000000000.00000000000000",
+    "1234000000.00088883231",
+    "3123.23111",
+    "-3123000000.23111",
+    "3123.2311100000",
+    "-03123.0023111",
+    "3123.23111",
+    "3123.23111",
+    *("1" + "0" * i + ".23111" for i in range(4, 10)),
+    "1000000000.3111",
+    "1000000000.111",
+    "1000000000.11",
+    *("1" + "0" * i + ".0" for i in range(8, 1, -1)),
+    "100",
+    *("100." + "1234567"[:i] for i in range(1, 8)),
+    "100.12345679",
+    "100.123456790",
+    "100.123456790000000000000000",
+    "1.0",
+    "0.0",
+    "-1.0",
+    "1.0E-1000",
+    "1E1000",
+    "0.000000000000010000000000001",
+    "0.00000000100000000000000001",
+    *("0." + "0" * i + "1" for i in range(26, -1, -1)),
+    *("0.1" + "0" * i for i in range(1, 6)),
+    *("0.00001" + "0" * i for i in range(3, 7)),
+    "1" + "0" * 117 + "." + "0" * 161,
+)))
+
 
 type_samples = [
     ('bool', 'bool', (
@@ -58,105 +115,13 @@ type_samples = [
         -2 ** 63, 2 ** 63 - 1,
         -1, 0, 1,
     )),
-    ('numeric', 'numeric', (
-        -(2 ** 64),
-        2 ** 64,
-        -(2 ** 128),
-        2 ** 128,
-        -1, 0, 1,
-        decimal.Decimal("0.00000000000000"),
-        decimal.Decimal("1.00000000000000"),
-        decimal.Decimal("-1.00000000000000"),
-        decimal.Decimal("-2.00000000000000"),
-        decimal.Decimal("1000000000000000.00000000000000"),
-        decimal.Decimal(1234),
-        decimal.Decimal(-1234),
-        decimal.Decimal("1234000000.00088883231"),
-        decimal.Decimal(str(1234.00088883231)),
-        decimal.Decimal("3123.23111"),
-        decimal.Decimal("-3123000000.23111"),
-        decimal.Decimal("3123.2311100000"),
-        decimal.Decimal("-03123.0023111"),
-        decimal.Decimal("3123.23111"),
-        decimal.Decimal("3123.23111"),
-        decimal.Decimal("10000.23111"),
-        decimal.Decimal("100000.23111"),
-        decimal.Decimal("1000000.23111"),
-        decimal.Decimal("10000000.23111"),
-        decimal.Decimal("100000000.23111"),
-        decimal.Decimal("1000000000.23111"),
-        decimal.Decimal("1000000000.3111"),
-        decimal.Decimal("1000000000.111"),
-        decimal.Decimal("1000000000.11"),
-        decimal.Decimal("100000000.0"),
-        decimal.Decimal("10000000.0"),
-        decimal.Decimal("1000000.0"),
-        decimal.Decimal("100000.0"),
-        decimal.Decimal("10000.0"),
-        decimal.Decimal("1000.0"),
-        decimal.Decimal("100.0"),
-        decimal.Decimal("100"),
-        decimal.Decimal("100.1"),
-        decimal.Decimal("100.12"),
-        decimal.Decimal("100.123"),
-        decimal.Decimal("100.1234"),
-        decimal.Decimal("100.12345"),
-        decimal.Decimal("100.123456"),
-        decimal.Decimal("100.1234567"),
-        decimal.Decimal("100.12345679"),
-        decimal.Decimal("100.123456790"),
-        decimal.Decimal("100.123456790000000000000000"),
-        decimal.Decimal("1.0"),
-        decimal.Decimal("0.0"),
-        decimal.Decimal("-1.0"),
-        decimal.Decimal("1.0E-1000"),
-        decimal.Decimal("1E1000"),
-        decimal.Decimal("0.000000000000000000000000001"),
-        decimal.Decimal("0.000000000000010000000000001"),
-        decimal.Decimal("0.00000000000000000000000001"),
-        decimal.Decimal("0.00000000100000000000000001"),
-        decimal.Decimal("0.0000000000000000000000001"),
-        decimal.Decimal("0.000000000000000000000001"),
-        decimal.Decimal("0.00000000000000000000001"),
-        decimal.Decimal("0.0000000000000000000001"),
-        decimal.Decimal("0.000000000000000000001"),
-        decimal.Decimal("0.00000000000000000001"),
-        decimal.Decimal("0.0000000000000000001"),
-        decimal.Decimal("0.000000000000000001"),
-        decimal.Decimal("0.00000000000000001"),
-        decimal.Decimal("0.0000000000000001"),
-        decimal.Decimal("0.000000000000001"),
-        decimal.Decimal("0.00000000000001"),
-        decimal.Decimal("0.0000000000001"),
-        decimal.Decimal("0.000000000001"),
-        decimal.Decimal("0.00000000001"),
-        decimal.Decimal("0.0000000001"),
-        decimal.Decimal("0.000000001"),
-        decimal.Decimal("0.00000001"),
-        decimal.Decimal("0.0000001"),
-        decimal.Decimal("0.000001"),
-        decimal.Decimal("0.00001"),
-        decimal.Decimal("0.0001"),
-        decimal.Decimal("0.001"),
-        decimal.Decimal("0.01"),
-        decimal.Decimal("0.1"),
-        decimal.Decimal("0.10"),
-        decimal.Decimal("0.100"),
-        decimal.Decimal("0.1000"),
-        decimal.Decimal("0.10000"),
-        decimal.Decimal("0.100000"),
-        decimal.Decimal("0.00001000"),
-        decimal.Decimal("0.000010000"),
-        decimal.Decimal("0.0000100000"),
-        decimal.Decimal("0.00001000000"),
-        decimal.Decimal("1" + "0" * 117 + "." + "0" * 161)
-    )),
+    ('numeric', 'numeric', numeric_samples),
     ('bytea', 'bytea', (
-        bytes(range(256)),
-        bytes(range(255, -1, -1)),
+        all_bytes_asc,
+        all_bytes_desc,
         b'\x00\x00',
         b'foo',
-        b'f' * 1024 * 1024,
+        large_bytea,
         dict(input=bytearray(b'\x02\x01'), output=b'\x02\x01'),
     )),
     ('text', 'text', (
@@ -416,20 +381,15 @@ type_samples = [
         dict(input=bytearray(b'\x02'), output=asyncpg.BitString('0000 0010')),
     ]),
     ('path', 'path', [
-        asyncpg.Path(asyncpg.Point(0.0, 0.0), asyncpg.Point(1.0, 1.0)),
-        asyncpg.Path(asyncpg.Point(0.0, 0.0), asyncpg.Point(1.0, 1.0),
-                     is_closed=True),
+        asyncpg.Path(point_0_0, point_1_1),
+        asyncpg.Path(point_0_0, point_1_1, is_closed=True),
         dict(input=((0.0, 0.0), (1.0, 1.0)),
-             output=asyncpg.Path(asyncpg.Point(0.0, 0.0),
-                                 asyncpg.Point(1.0, 1.0),
-                                 is_closed=True)),
+             output=asyncpg.Path(point_0_0, point_1_1, is_closed=True)),
         dict(input=[(0.0, 0.0), (1.0, 1.0)],
-             output=asyncpg.Path(asyncpg.Point(0.0, 0.0),
-                                 asyncpg.Point(1.0, 1.0),
-                                 is_closed=False)),
+             output=asyncpg.Path(point_0_0, point_1_1, is_closed=False)),
     ]),
     ('point', 'point', [
-        asyncpg.Point(0.0, 0.0),
+        point_0_0,
         asyncpg.Point(1.0, 2.0),
     ]),
     ('box', 'box', [
@@ -442,8 +402,8 @@ type_samples = [
         asyncpg.LineSegment((1, 2), (2, 2)),
     ]),
     ('polygon', 'polygon', [
-        asyncpg.Polygon(asyncpg.Point(0.0, 0.0), asyncpg.Point(1.0, 0.0),
-                        asyncpg.Point(1.0, 1.0), asyncpg.Point(0.0, 1.0)),
+        asyncpg.Polygon(point_0_0, asyncpg.Point(1.0, 0.0),
+                        point_1_1, asyncpg.Point(0.0, 1.0)),
     ]),
     ('circle', 'circle', [
         asyncpg.Circle((0.0, 0.0), 100),
@@ -477,13 +437,9 @@ class TestCodecs(tb.ConnectedTestCase):
                 "SELECT $1::" + typname
             )
 
-            text_in = await self.con.prepare(
-                "SELECT $1::text::" + typname
-            )
-
-            text_out = await self.con.prepare(
-                "SELECT $1::" + typname + "::text"
-            )
+            # Text I/O statements are only needed by some of the samples,
+            # so prepare them lazily.
+            text_in = text_out = None
 
             for sample in sample_data:
                 with self.subTest(sample=sample, typname=typname):
@@ -491,6 +447,10 @@ class TestCodecs(tb.ConnectedTestCase):
                     if isinstance(sample, dict):
                         if 'textinput' in sample:
                             inputval = sample['textinput']
+                            if text_in is None:
+                                text_in = await self.con.prepare(
+                                    "SELECT $1::text::" + typname
+                                )
                             stmt = text_in
                         else:
                             inputval = sample['input']
@@ -501,6 +461,10 @@ class TestCodecs(tb.ConnectedTestCase):
                                 raise ValueError(
                                     'cannot test "textin" and'
                                     ' "textout" simultaneously')
+                            if text_out is None:
+                                text_out = await self.con.prepare(
+                                    "SELECT $1::" + typname + "::text"
+                                )
                             stmt = text_out
                         else:
                             outputval = sample['output']
@@ -511,29 +475,26 @@ class TestCodecs(tb.ConnectedTestCase):
                         inputval = outputval = sample
 
                     result = await stmt.fetchval(inputval)
-                    err_msg = (
-                        "unexpected result for {} when passing {!r}: "
-                        "received {!r}, expected {!r}".format(
-                            typname, inputval, result, outputval))
 
                     if typname.startswith('float'):
                         if math.isnan(outputval):
-                            if not math.isnan(result):
-                                self.fail(err_msg)
+                            ok = math.isnan(result)
                         else:
-                            self.assertTrue(
-                                math.isclose(result, outputval, rel_tol=1e-6),
-                                err_msg)
+                            ok = math.isclose(result, outputval, rel_tol=1e-6)
                     else:
-                        self.assertEqual(result, outputval, err_msg)
+                        ok = result == outputval
 
-                    if (typname == 'numeric' and
+                    if (ok and typname == 'numeric' and
                             isinstance(inputval, decimal.Decimal)):
-                        self.assertEqual(
-                            result.as_tuple(),
-                            outputval.as_tuple(),
-                            err_msg,
-                        )
+                        ok = result.as_tuple() == outputval.as_tuple()
+
+                    if not ok:
+                        # Only format the message on failure: the reprs
+                        # of some samples are megabytes long.
+                        self.fail(
+                            "unexpected result for {} when passing {!r}: "
+                            "received {!r}, expected {!r}".format(
+                                typname, inputval, result, outputval))
 
             with self.subTest(sample=None, typname=typname):
                 # Test that None is handled for all types.
@@ -758,12 +719,11 @@ class TestCodecs(tb.ConnectedTestCase):
 
         for typname, errmsg, data in cases:
             stmt = await self.con.prepare("SELECT $1::" + typname)
+            full_errmsg = re.compile(
+                r'invalid input for query argument \$1:.*' + errmsg)
 
             for sample in data:
                 with self.subTest(sample=sample, typname=typname):
-                    full_errmsg = (
-                        r'invalid input for query argument \$1:.*' + errmsg)
-
                     with self.assertRaisesRegex(
                             asyncpg.DataError, full_errmsg):
                         await stmt.fetchval(sample)
@@ -1187,27 +1147,26 @@ class TestCodecs(tb.ConnectedTestCase):
             CREATE EXTENSION IF NOT EXISTS hstore
         ''')
 
-        longstruct = struct.Struct('!L')
-        ulong_unpack = lambda b: longstruct.unpack_from(b)[0]
-        ulong_pack = longstruct.pack
+        int32_unpack_from = int32_struct.unpack_from
+        int32_pack_into = int32_struct.pack_into
 
         def hstore_decoder(data):
             result = {}
-            n = ulong_unpack(data)
-            view = memoryview(data)
+            (n,) = int32_unpack_from(data)
             ptr = 4
 
             for i in range(n):
-                klen = ulong_unpack(view[ptr:ptr + 4])
+                (klen,) = int32_unpack_from(data, ptr)
                 ptr += 4
-                k = bytes(view[ptr:ptr + klen]).decode()
+                k = data[ptr:ptr + klen].decode()
                 ptr += klen
-                vlen = ulong_unpack(view[ptr:ptr + 4])
+                # NULL values are sent with a length of -1.
+                (vlen,) = int32_unpack_from(data, ptr)
                 ptr += 4
                 if vlen == -1:
                     v = None
                 else:
-                    v = bytes(view[ptr:ptr + vlen]).decode()
+                    v = data[ptr:ptr + vlen].decode()
                     ptr += vlen
 
                 result[k] = v
@@ -1215,17 +1174,33 @@ class TestCodecs(tb.ConnectedTestCase):
             return result
 
         def hstore_encoder(obj):
-            buffer = bytearray(ulong_pack(len(obj)))
+            items = [(k.encode(), v.encode() if v is not None else None)
+                     for k, v in obj.items()]
+
+            size = 4
+            for kenc, venc in items:
+                size += 8 + len(kenc)
+                if venc is not None:
+                    size += len(venc)
+
+            buffer = bytearray(size)
+            int32_pack_into(buffer, 0, len(items))
+            ptr = 4
 
-            for k, v in obj.items():
-                kenc = k.encode()
-                buffer += ulong_pack(len(kenc)) + kenc
+            for kenc, venc in items:
+                int32_pack_into(buffer, ptr, len(kenc))
+                ptr += 4
+                buffer[ptr:ptr + len(kenc)] = kenc
+                ptr += len(kenc)
 
-                if v is None:
-                    buffer += b'\xFF\xFF\xFF\xFF'  # -1
+                if venc is None:
+                    int32_pack_into(buffer, ptr, -1)
+                    ptr += 4
                 else:
-                    venc = v.encode()
-                    buffer += ulong_pack(len(venc)) + venc
+                    int32_pack_into(buffer, ptr, len(venc))
+                    ptr += 4
+                    buffer[ptr:ptr + len(venc)] = venc
+                    ptr += len(venc)
 
             return buffer
 
@@ -1359,33 +1334,23 @@ class TestCodecs(tb.ConnectedTestCase):
 
     async def test_custom_codec_override_binary(self):
         """Test overriding core codecs."""
-        import json
-
-        conn = await self.connect()
-        try:
-            def _encoder(value):
-                return json.dumps(value).encode('utf-8')
-
-            def _decoder(value):
-                return json.loads(value.decode('utf-8'))
+        def _encoder(value):
+            return json.dumps(value).encode('utf-8')
 
-            await conn.set_type_codec(
-                'json', encoder=_encoder, decoder=_decoder,
-                schema='pg_catalog', format='binary'
-            )
+        def _decoder(value):
+            return json.loads(value.decode('utf-8'))
 
-            data = {'foo': 'bar', 'spam': 1}
-            res = await conn.fetchval('SELECT $1::json', data)
-            self.assertEqual(data, res)
+        await self.con.set_type_codec(
+            'json', encoder=_encoder, decoder=_decoder,
+            schema='pg_catalog', format='binary'
+        )
 
-        finally:
-            await conn.close()
+        data = {'foo': 'bar', 'spam': 1}
+        res = await self.con.fetchval('SELECT $1::json', data)
+        self.assertEqual(data, res)
 
     async def test_custom_codec_override_text(self):
         """Test overriding core codecs."""
-        import json
-
-        conn = await self.connect()
         try:
             def _encoder(value):
                 return json.dumps(value)
@@ -1393,21 +1358,21 @@ class TestCodecs(tb.ConnectedTestCase):
             def _decoder(value):
                 return json.loads(value)
 
-            await conn.set_type_codec(
+            await self.con.set_type_codec(
                 'json', encoder=_encoder, decoder=_decoder,
                 schema='pg_catalog', format='text'
             )
 
             data = {'foo': 'bar', 'spam': 1}
-            res = await conn.fetchval('SELECT $1::json', data)
+            res = await self.con.fetchval('SELECT $1::json', data)
             self.assertEqual(data, res)
 
-            res = await conn.fetchval('SELECT $1::json[]', [data])
+            res = await self.con.fetchval('SELECT $1::json[]', [data])
             self.assertEqual([data], res)
 
-            await conn.execute('CREATE DOMAIN my_json AS json')
+            await self.con.execute('CREATE DOMAIN my_json AS json')
 
-            res = await conn.fetchval('SELECT $1::my_json', data)
+            res = await self.con.fetchval('SELECT $1::my_json', data)
             self.assertEqual(data, res)
 
             def _encoder(value):
@@ -1416,17 +1381,16 @@ class TestCodecs(tb.ConnectedTestCase):
             def _decoder(value):
                 return value
 
-            await conn.set_type_codec(
+            await self.con.set_type_codec(
                 'uuid', encoder=_encoder, decoder=_decoder,
                 schema='pg_catalog', format='text'
             )
 
             data = '14058ad9-0118-4b7e-ac15-01bc13e2ccd1'
-            res = await conn.fetchval('SELECT $1::uuid', data)
+            res = await self.con.fetchval('SELECT $1::uuid', data)
             self.assertEqual(res, data)
         finally:
-            await conn.execute('DROP DOMAIN IF EXISTS my_json')
-            await conn.close()
+            await self.con.execute('DROP DOMAIN IF EXISTS my_json')
 
     async def test_custom_codec_override_tuple(self):
         """Test overriding core codecs."""
@@ -1446,47 +1410,42 @@ class TestCodecs(tb.ConnectedTestCase):
             ('interval', (2, 3, 1), '2 mons 3 days 00:00:00.000001')
         ]
 
-        conn = await self.connect()
-
         def _encoder(value):
             return tuple(value)
 
         def _decoder(value):
             return tuple(value)
 
-        try:
-            for (typename, data, expected_result, *extra) in cases:
-                with self.subTest(type=typename):
-                    await self.con.execute(
-                        'CREATE TABLE tab (v {})'.format(typename))
+        for (typename, data, expected_result, *extra) in cases:
+            with self.subTest(type=typename):
+                await self.con.execute(
+                    'CREATE TABLE tab (v {})'.format(typename))
 
-                    try:
-                        await conn.set_type_codec(
-                            typename, encoder=_encoder, decoder=_decoder,
-                            schema='pg_catalog', format='tuple'
-                        )
+                try:
+                    await self.con.set_type_codec(
+                        typename, encoder=_encoder, decoder=_decoder,
+                        schema='pg_catalog', format='tuple'
+                    )
 
-                        await conn.execute(
-                            'INSERT INTO tab VALUES ($1)', data)
+                    await self.con.execute(
+                        'INSERT INTO tab VALUES ($1)', data)
 
-                        res = await conn.fetchval('SELECT tab.v FROM tab')
-                        self.assertEqual(res, data)
+                    res = await self.con.fetchval('SELECT tab.v FROM tab')
+                    self.assertEqual(res, data)
 
-                        await conn.reset_type_codec(
-                            typename, schema='pg_catalog')
+                    await self.con.reset_type_codec(
+                        typename, schema='pg_catalog')
 
-                        if extra:
-                            val = extra[0]
-                        else:
-                            val = 'tab.v'
+                    if extra:
+                        val = extra[0]
+                    else:
+                        val = 'tab.v'
 
-                        res = await conn.fetchval(
-                            'SELECT ({val})::text FROM tab'.format(val=val))
-                        self.assertEqual(res, expected_result)
-                    finally:
-                        await self.con.execute('DROP TABLE tab')
-        finally:
-            await conn.close()
+                    res = await self.con.fetchval(
+                        'SELECT ({val})::text FROM tab'.format(val=val))
+                    self.assertEqual(res, expected_result)
+                finally:
+                    await self.con.execute('DROP TABLE tab')
 
     async def test_timetz_encoding(self):
         try:
@@ -1836,8 +1795,6 @@ class TestCodecs(tb.ConnectedTestCase):
         self.assertTupleEqual(st.get_attributes(), ())
 
     async def test_array_with_custom_json_text_codec(self):
-        import json
-
         await self.con.execute('CREATE TABLE tab (id serial, val json[]);')
         insert_sql = 'INSERT INTO tab (val) VALUES (cast($1 AS json[]));'
         query_sql = 'SELECT val FROM tab ORDER BY id DESC;'